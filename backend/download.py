@@ -21,15 +21,16 @@ def download_model():
         print(f"Downloading model from {model_id}...")
         model = AutoModelForCausalLM.from_pretrained(
             model_id,
-            torch_dtype=torch.float32,
+            torch_dtype=torch.bfloat16,
             low_cpu_mem_usage=True,
+            use_safetensors=True,
             trust_remote_code=True
         )
         
         print("Saving files locally...")
-        # Save the model and tokenizer locally
+        # Save the model and tokenizer locally (safetensors shards are mmapped on load)
         model_path = "models/tinyllama"
-        model.save_pretrained(model_path)
+        model.save_pretrained(model_path, safe_serialization=True)
         tokenizer.save_pretrained(model_path)
         
         print(f"Download complete! Files saved to {model_path}")
@@ -1,21 +1,24 @@
 import torch
-from ctransformers import AutoModelForCausalLM
-from flask import Flask, request, jsonify
-from pathlib import Path
-from flask_cors import CORS
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+import uvicorn
 import logging
 from utils.model_manager import ModelManager
-from utils.config import load_category_keywords
+from utils.classifier import classify_text, EXPLANATIONS
+from utils.batcher import RequestBatcher
+from utils.inference_handler import get_handler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
-
-# Load categories from config file
-CATEGORY_KEYWORDS = load_category_keywords()
-
+class PromptRequest(BaseModel):
+    prompt: str = ""
+    stream: bool = False  # Reply with server-sent events instead of one JSON body
 
 # Initialize the ModelManager
 manager = ModelManager(
@@ -30,152 +33,151 @@ success = manager.ensure_models()
 if not success:
     raise RuntimeError("Failed to download required models")
 
-# Determine the best device
+# Pick how many layers to offload and the context size for the available device
 if torch.backends.mps.is_available():
-    device = torch.device("mps")
+    # Keep MPS offload small to prevent memory issues
+    gpu_layers, context_length = 4, 1024
     logger.info("Using MPS (Apple Silicon) device")
 elif torch.cuda.is_available():
-    device = torch.device("cuda")
+    # Size the offload to free VRAM when the model loads
+    gpu_layers, context_length = -1, 2048
     logger.info("Using CUDA device")
 else:
-    device = torch.device("cpu")
+    gpu_layers, context_length = 0, 2048
     logger.info("Using CPU device")
 
+# Load the model once for the process lifetime, the handler retries once
+# on CPU if the GPU load fails
+logger.info("Starting to load model...")
+handler = get_handler(
+    manager.get_model_path("tinyllama"),
+    context_length=context_length,
+    gpu_layers=gpu_layers,
+    temperature=0.7,
+    top_p=0.95
+)
+logger.info(f"Model loaded successfully with {handler.gpu_layers} GPU layers!")
 
-def classify_text(text):
-    text = text.lower()
-    matches = {}
+
+def generate_batch(jobs):
+    """Run queued (prompt, on_token) jobs through the model on the batcher's worker thread
     
-    # Count keyword matches for each category
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        count = sum(1 for keyword in keywords if keyword.lower() in text)
-        if count > 0:
-            matches[category] = count
+    The llama.cpp model decodes a single sequence per call, so prompts are handled
+    one after another; the batcher keeps concurrent requests off the model.
+    Jobs with an on_token callback are streamed through it and resolve to None.
+    A failing job resolves to its exception without affecting the rest of the batch.
+    """
+    responses = []
+    for text, on_token in jobs:
+        try:
+            if on_token is None:
+                responses.append(handler.generate_response_sync(text, max_tokens=256))
+            else:
+                for token in handler.generate_response(text, max_tokens=256):
+                    on_token(token)
+                responses.append(None)
+        except Exception as e:
+            responses.append(e)
+    return responses
+
+# Funnel every generation through one worker that drains up to 8 queued
+# prompts per pass. No extra wait is added since the model can't decode them together.
+batcher = RequestBatcher(generate_batch, max_batch_size=8, max_delay=0.0)
+
+def warmup():
+    """Run a one-token generation so the first request doesn't pay kernel and graph setup"""
+    try:
+        handler.generate_response_sync("warmup", max_tokens=1)
+        logger.info("Model warmup complete")
+    except Exception as e:
+        logger.warning(f"Model warmup failed: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app):
+    """Warm the model up on startup; on shutdown finish queued generations, then release it"""
+    warmup()
+    yield
+    # The worker thread may still be decoding; the model must outlive it
+    await asyncio.to_thread(batcher.stop)
+    handler.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"]
+)
+
+async def stream_events(text, result):
+    """Yield the classification as the first server-sent event, then generated tokens"""
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
     
-    if matches:
-        best_category = max(matches.items(), key=lambda x: x[1])
-        confidence = "High" if best_category[1] > 1 else "Medium"
-        return best_category[0], confidence
+    def on_token(token):
+        loop.call_soon_threadsafe(tokens.put_nowait, token)
     
-    return "Other", "Low"
-
-# Initialize model with ctransformers
-try:
-    logger.info("Starting to load model...")
-    model_path = Path("./models/tinyllama")
+    done = batcher.submit((text, on_token))
+    done.add_done_callback(lambda _: loop.call_soon_threadsafe(tokens.put_nowait, None))
     
-    # Start with CPU by default for more stability
-    gpu_layers = 0
+    yield f"data: {json.dumps(result)}\n\n"
+    while (token := await tokens.get()) is not None:
+        yield f"data: {json.dumps({'token': token})}\n\n"
     
-    if torch.backends.mps.is_available():
-        try:
-            logger.info("Attempting to use MPS (Apple Silicon) device...")
-            # Reduce GPU layers to prevent memory issues
-            gpu_layers = 4  # Reduced from 50
-            model = AutoModelForCausalLM.from_pretrained(
-                str(model_path),
-                model_type="llama",
-                gpu_layers=gpu_layers,
-                context_length=1024,
-                temperature=0.7,
-                top_p=0.95
-            )
-            logger.info("Successfully initialized model with MPS")
-        except Exception as e:
-            logger.warning(f"Failed to initialize with MPS, falling back to CPU: {e}")
-            gpu_layers = 0
-            model = AutoModelForCausalLM.from_pretrained(
-                str(model_path),
-                model_type="llama",
-                gpu_layers=0,
-                context_length=2048,
-                temperature=0.7,
-                top_p=0.95
-            )
-    elif torch.cuda.is_available():
-        logger.info("Using CUDA device")
-        model = AutoModelForCausalLM.from_pretrained(
-            str(model_path),
-            model_type="llama",
-            gpu_layers=50,
-            context_length=2048,
-            temperature=0.7,
-            top_p=0.95
-        )
-    else:
-        logger.info("Using CPU device")
-        model = AutoModelForCausalLM.from_pretrained(
-            str(model_path),
-            model_type="llama",
-            gpu_layers=0,
-            context_length=2048,
-            temperature=0.7,
-            top_p=0.95
-        )
-    logger.info(f"Model loaded successfully with {gpu_layers} GPU layers!")
-except Exception as e:
-    logger.error(f"Error loading model: {str(e)}")
-    raise
-
-@app.route("/generate", methods=["POST"])
-def generate():
+    error = done.exception()
+    if error is not None:
+        logger.error(f"Error during generation: {str(error)}")
+        yield f"event: error\ndata: {json.dumps({'explanation': str(error)})}\n\n"
+
+def classify_prompt(text):
+    """Classify text by keywords into the JSON body returned to the extension"""
+    category, confidence = classify_text(text)
+    return {
+        "category": category,
+        "confidence": confidence,
+        "explanation": EXPLANATIONS.get(category, "Category determined based on content analysis.")
+    }
+
+@app.post("/generate")
+async def generate(req: PromptRequest):
     try:
-        text = request.json.get("prompt", "")
+        text = req.prompt
         logger.info(f"Processing text: {text}")
         
-        # Use keyword-based classification
-        category, confidence = classify_text(text)
-        
-        # Format prompt for TinyLlama
-        formatted_prompt = f"<|system|>You are a helpful AI assistant.</s><|user|>{text}</s><|assistant|>"
-        
-        # Generate response using the model
-        response = model(
-            formatted_prompt,
-            max_new_tokens=256,
-            temperature=0.7,
-            top_p=0.95,
-            stream=False
-        )
-        
-        # Clean up response
-        response = response.split("<|assistant|>")[-1].strip()
+        # Use keyword-based classification; no model output is needed here
+        return classify_prompt(text)
+            
+    except Exception as e:
+        logger.error(f"Error during classification: {str(e)}")
+        return JSONResponse(status_code=500, content={
+            "category": "Error",
+            "confidence": "Low",
+            "explanation": str(e)
+        })
+
+@app.post("/explain")
+async def explain(req: PromptRequest):
+    try:
+        text = req.prompt
+        logger.info(f"Explaining text: {text}")
         
-        # Generate explanation based on category
-        explanations = {
-            "E-commerce/Marketplace": "This text describes a platform for buying and selling.",
-            "Technology/IoT": "This text involves technological devices or IoT capabilities.",
-            "Weather/Climate": "This text relates to weather analysis or climate data.",
-            "Blockchain/Crypto": "This text involves blockchain technology or cryptocurrency.",
-            "Social Media": "This text describes social networking features.",
-            "Productivity": "This text involves tools for improving efficiency.",
-            "Entertainment": "This text relates to entertainment content.",
-            "Health/Medical": "This text involves health-related services.",
-            "Communication": "This text describes communication features.",
-            "News": "This text involves news articles or updates.",
-            "Education": "This text relates to educational content or learning resources.",
-            "Finance": "This text involves financial services or investment information.",
-            "Travel": "This text describes travel or tourism services.",
-            "Food": "This text relates to food, recipes, or dining experiences.",
-            "Space/Aerospace": "This text involves space exploration or aerospace technology.",
-            "Sports": "This text describes sports events or competitions.",
-            "Fitness": "This text involves fitness activities or wellness programs.",
-            "Other": "This text doesn't clearly match our predefined categories."
-        }
+        result = classify_prompt(text)
+        if req.stream:
+            return StreamingResponse(stream_events(text, result), media_type="text/event-stream")
         
-        return jsonify({
-            "category": category,
-            "confidence": confidence,
-            "explanation": explanations.get(category, "Category determined based on content analysis.")
-        })
+        # Generate response using the model, awaiting the batcher's worker
+        # thread so the event loop keeps accepting requests
+        result["response"] = await asyncio.wrap_future(batcher.submit((text, None)))
+        return result
             
     except Exception as e:
-        logger.error(f"Error during classification: {str(e)}")
-        return jsonify({
+        logger.error(f"Error during generation: {str(e)}")
+        return JSONResponse(status_code=500, content={
             "category": "Error",
             "confidence": "Low",
             "explanation": str(e)
-        }), 500
+        })
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    # A single worker process owns the model; uvloop is used when installed
+    uvicorn.run(app, host="0.0.0.0", port=8000, workers=1)
\ No newline at end of file
@@ -0,0 +1,93 @@
+# File: backend/utils/batcher.py
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class RequestBatcher:
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8,
+                 max_delay: float = 0.02):
+        """
+        Coalesce concurrent requests into batches handled by a single worker thread
+
+        Args:
+            process_batch: Callable that takes a list of items and returns one result per item;
+                an exception instance in place of a result fails only that item
+            max_batch_size: Maximum number of items passed to process_batch at once
+            max_delay: Seconds to wait for more items once the first one arrives
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        # Items are (item, future) pairs; None tells the worker to stop
+        self._queue: "queue.Queue[Optional[Tuple[Any, Future]]]" = queue.Queue()
+        self._stopped = False
+        self._worker = threading.Thread(target=self._run, name="request-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item and return a future for its result"""
+        if self._stopped:
+            raise RuntimeError("RequestBatcher is stopped")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Queue an item and block until its result is ready"""
+        return self.submit(item).result(timeout)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Finish the items already queued, then stop the worker thread"""
+        self._stopped = True
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def _collect_batch(self) -> List[Tuple[Any, Future]]:
+        """Block for one item, then drain whatever else arrives before the deadline
+
+        Returns an empty list once stop() was called and earlier items are done.
+        """
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                return
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                logging.error(f"Error processing batch of {len(batch)}: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,95 @@
+# File: backend/utils/classifier.py
+
+from collections import Counter
+
+from .config import load_category_keywords
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional, fall back to substring scans
+    ahocorasick = None
+
+# Load categories from config file
+CATEGORY_KEYWORDS = load_category_keywords()
+
+# Lowercase keywords once rather than on every request
+CATEGORY_KEYWORDS_LC = {
+    category: tuple(keyword.lower() for keyword in keywords)
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+
+def build_keyword_automaton(category_keywords):
+    """Build one Aho-Corasick automaton mapping each lowercased keyword to its categories"""
+    keyword_categories = {}
+    for category, keywords in category_keywords.items():
+        for keyword in keywords:
+            keyword_categories.setdefault(keyword, []).append(category)
+
+    automaton = ahocorasick.Automaton()
+    for keyword, categories in keyword_categories.items():
+        automaton.add_word(keyword, (keyword, categories))
+    automaton.make_automaton()
+    return automaton
+
+
+# Match every keyword in a single pass over the text
+KEYWORD_AUTOMATON = build_keyword_automaton(CATEGORY_KEYWORDS_LC) if ahocorasick else None
+
+# Explanation returned for each category
+EXPLANATIONS = {
+    "E-commerce/Marketplace": "This text describes a platform for buying and selling.",
+    "Technology/IoT": "This text involves technological devices or IoT capabilities.",
+    "Weather/Climate": "This text relates to weather analysis or climate data.",
+    "Blockchain/Crypto": "This text involves blockchain technology or cryptocurrency.",
+    "Social Media": "This text describes social networking features.",
+    "Productivity": "This text involves tools for improving efficiency.",
+    "Entertainment": "This text relates to entertainment content.",
+    "Health/Medical": "This text involves health-related services.",
+    "Communication": "This text describes communication features.",
+    "News": "This text involves news articles or updates.",
+    "Education": "This text relates to educational content or learning resources.",
+    "Finance": "This text involves financial services or investment information.",
+    "Travel": "This text describes travel or tourism services.",
+    "Food": "This text relates to food, recipes, or dining experiences.",
+    "Space/Aerospace": "This text involves space exploration or aerospace technology.",
+    "Sports": "This text describes sports events or competitions.",
+    "Fitness": "This text involves fitness activities or wellness programs.",
+    "Other": "This text doesn't clearly match our predefined categories."
+}
+
+
+def classify_text(text):
+    """Classify text by keyword matches, returning (category, confidence)"""
+    if not text:
+        return "Other", "Low"
+    text = text.lower()
+    
+    # Count keyword matches for each category
+    if KEYWORD_AUTOMATON is not None:
+        counts = Counter()
+        seen = set()
+        for _, (keyword, categories) in KEYWORD_AUTOMATON.iter(text):
+            # A keyword counts once no matter how often it occurs
+            if keyword not in seen:
+                seen.add(keyword)
+                counts.update(categories)
+        # Keep config order so ties resolve the same way as the linear scan
+        matches = {category: counts[category] for category in CATEGORY_KEYWORDS if counts[category]}
+    else:
+        matches = {}
+        for category, keywords in CATEGORY_KEYWORDS_LC.items():
+            # Plain loop avoids allocating a generator per category
+            count = 0
+            for keyword in keywords:
+                if keyword in text:
+                    count += 1
+            if count > 0:
+                matches[category] = count
+    
+    if matches:
+        best_category = max(matches.items(), key=lambda x: x[1])
+        confidence = "High" if best_category[1] > 1 else "Medium"
+        return best_category[0], confidence
+    
+    return "Other", "Low"
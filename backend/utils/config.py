@@ -1,10 +1,18 @@
 import yaml
 from pathlib import Path
+from functools import lru_cache
 import os
 
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml C parser
+except ImportError:
+    from yaml import SafeLoader
+
+@lru_cache(maxsize=4)
 def load_category_keywords(config_path: str = "categories.yaml") -> dict:
     """
     Load category keywords from a YAML configuration file.
+    The result is cached per config_path, so the lookup and parse happen once.
     
     Args:
         config_path (str): Path to the YAML configuration file
@@ -28,7 +36,7 @@ def load_category_keywords(config_path: str = "categories.yaml") -> dict:
         for path in possible_paths:
             if path.is_file():
                 with open(path) as f:
-                    config = yaml.safe_load(f)
+                    config = yaml.load(f, Loader=SafeLoader)
                     return config.get('categories', {})
                     
         # If we get here, we couldn't find the file
@@ -1,56 +1,175 @@
 # File: backend/utils/inference_handler.py
 
-from ctransformers import AutoModelForCausalLM
+from llama_cpp import Llama, LlamaRAMCache
+from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+import torch
 import logging
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterator
 from pathlib import Path
 import gc
+import os
+import threading
+import weakref
+
+try:
+    from gguf import GGUFReader
+except ImportError:  # gguf is optional, used to size GPU offload per layer
+    GGUFReader = None
+
+# VRAM left free for llama.cpp scratch buffers when sizing GPU offload
+VRAM_HEADROOM_BYTES = 1024 * 1024 * 1024
+# Partial offloads below this fraction of layers are slower than CPU-only
+MIN_OFFLOAD_FRACTION = 0.4
+# Chat template markers that end the assistant turn
+STOP_SEQUENCES = ["</s>", "<|user|>", "<|system|>"]
+
+# Loaded models by id() of the handler that owns them
+_LOADED_MODELS: "weakref.WeakValueDictionary[int, Llama]" = weakref.WeakValueDictionary()
+
+
+def _release_model_refs(handler_id: int):
+    """Free the model of a handler that was closed or garbage collected"""
+    model = _LOADED_MODELS.pop(handler_id, None)
+    # Older llama-cpp-python releases have no close() and free on collection
+    if model is not None and hasattr(model, "close"):
+        model.close()
 
 
 class InferenceHandler:
+    # TinyLlama chat template around the user prompt
+    _SYS_PREFIX = "<|system|>You are a helpful AI assistant.</s><|user|>"
+    _ASST_SUFFIX = "</s><|assistant|>"
+
     def __init__(self, model_path: Path, 
                  context_length: int = 2048,
                  gpu_layers: int = 0,
                  temperature: float = 0.7,
-                 top_p: float = 0.95):
+                 top_p: float = 0.95,
+                 prompt_cache_bytes: int = 0,
+                 n_threads: Optional[int] = None,
+                 n_batch: int = 512,
+                 use_mlock: bool = False,
+                 system_prompt: Optional[str] = None):
         """
         Initialize the inference handler for GGUF models
         
         Args:
             model_path: Path to the .gguf model file
             context_length: Maximum context length for the model
-            gpu_layers: Number of layers to offload to GPU (0 for CPU-only)
+            gpu_layers: Number of layers to offload to GPU (0 for CPU-only, -1 to fit free VRAM)
             temperature: Sampling temperature (0.0 to 1.0)
             top_p: Top-p sampling parameter (0.0 to 1.0)
+            prompt_cache_bytes: RAM for saved KV states of earlier prompts (0 to disable);
+                ignored while a draft model is set, see _enable_prompt_cache
+            n_threads: CPU threads for generation (defaults to half the logical cores)
+            n_batch: Prompt tokens evaluated per batch during prefill
+            use_mlock: Lock the mmapped model in RAM so it can't be paged out
+            system_prompt: Replaces the default system message of the chat template
         """
         self.model_path = model_path
         self.context_length = context_length
         self.gpu_layers = gpu_layers
         self.temperature = temperature
         self.top_p = top_p
+        self.prompt_cache_bytes = prompt_cache_bytes
+        self.n_threads = n_threads or max(1, (os.cpu_count() or 2) // 2)
+        self.n_batch = n_batch
+        self.use_mlock = use_mlock
         self.model = None
-    
-    def __del__(self):
-        self._cleanup()
+        if system_prompt is None:
+            self._sys_prefix = self._SYS_PREFIX
+        else:
+            self._sys_prefix = f"<|system|>{system_prompt}</s><|user|>"
+        self._sys_ids = []
+        self._asst_ids = []
+        # Held while generating so close() can't free the model mid-decode
+        self._lock = threading.Lock()
+        # Frees the model when the handler is collected or the process exits
+        self._finalizer = weakref.finalize(self, _release_model_refs, id(self))
+        
+    def close(self):
+        """Release the model once any running generation finishes
+
+        Otherwise the model stays loaded for the process lifetime.
+        """
+        with self._lock:
+            self._cleanup()
         
     def _cleanup(self):
         """Cleanup resources to avoid GPU/CPU leaks"""
-        if self.model:
-            del self.model
-            self.model = None
-        gc.collect()
+        _release_model_refs(id(self))
+        self.model = None
+        if self.gpu_layers != 0:
+            gc.collect()  # Hand VRAM back promptly; CPU memory is freed without it
     
+    def _read_layer_info(self):
+        """Read (n_layers, kv_width) from the GGUF header, or None if unavailable"""
+        if GGUFReader is None:
+            return None
+        try:
+            fields = GGUFReader(str(self.model_path)).fields
+            
+            def value(key):
+                field = fields[key]
+                return field.parts[field.data[0]]
+            
+            arch = bytes(value("general.architecture")).decode()
+            n_layers = int(value(f"{arch}.block_count")[0])
+            n_embd = int(value(f"{arch}.embedding_length")[0])
+            n_head = int(value(f"{arch}.attention.head_count")[0])
+            n_head_kv = int(value(f"{arch}.attention.head_count_kv")[0]) if f"{arch}.attention.head_count_kv" in fields else n_head
+            return n_layers, n_embd * n_head_kv // n_head
+        except Exception as e:
+            logging.warning(f"Could not read layer info from {self.model_path}: {str(e)}")
+            return None
+
+    def _autotune_gpu_layers(self) -> int:
+        """Offload as many layers as fit in free VRAM, or none if too few fit to help"""
+        if not torch.cuda.is_available():
+            return 0
+        free_bytes, _ = torch.cuda.mem_get_info()
+        budget = free_bytes - VRAM_HEADROOM_BYTES
+        model_bytes = self.model_path.stat().st_size
+        
+        layer_info = self._read_layer_info()
+        if layer_info is None:
+            # Without a layer count, offload everything only if it all fits
+            return -1 if model_bytes < budget else 0
+        
+        n_layers, kv_width = layer_info
+        # Weights per layer plus its f16 K and V cache for the full context
+        layer_bytes = model_bytes / n_layers + 2 * self.context_length * kv_width * 2
+        layers = min(n_layers, max(0, int(budget // layer_bytes)))
+        if layers == n_layers:
+            return -1  # Everything fits, output layer included
+        if layers < MIN_OFFLOAD_FRACTION * n_layers:
+            return 0
+        return layers
+
     def load_model(self):
         """Load the GGUF model"""
+        if self.gpu_layers < 0:
+            self.gpu_layers = self._autotune_gpu_layers()
+            logging.info(f"Sized GPU offload to free VRAM: {self.gpu_layers} layers (-1 for all)")
         try:
-            self.model = AutoModelForCausalLM.from_pretrained(
-                str(self.model_path),
-                model_type="llama",
-                context_length=self.context_length,
-                gpu_layers=self.gpu_layers,
-                temperature=self.temperature,
-                top_p=self.top_p
+            self.model = Llama(
+                model_path=str(self.model_path),
+                n_ctx=self.context_length,
+                n_gpu_layers=self.gpu_layers,
+                n_threads=self.n_threads,
+                n_batch=self.n_batch,
+                use_mmap=True,  # Map the GGUF file instead of copying it into memory
+                use_mlock=self.use_mlock,
+                # A draft model makes llama.cpp keep logits for every token; scores
+                # must be sized to match or eval fails once the prompt passes n_batch
+                logits_all=True,
+                # Speculative decoding with draft tokens looked up from the prompt itself
+                draft_model=LlamaPromptLookupDecoding(num_pred_tokens=10),
+                verbose=False
             )
+            _LOADED_MODELS[id(self)] = self.model
+            self._enable_prompt_cache()
+            self._tokenize_template()
             logging.info(f"Successfully loaded model from {self.model_path} with GPU layers: {self.gpu_layers}")
             return True
         except Exception as e:
@@ -61,27 +180,60 @@ class InferenceHandler:
     def _load_model_on_cpu(self):
         """Load the model with CPU-only fallback"""
         try:
-            self.model = AutoModelForCausalLM.from_pretrained(
-                str(self.model_path),
-                model_type="llama",
-                context_length=self.context_length,
-                gpu_layers=0,  # Force CPU-only
-                temperature=self.temperature,
-                top_p=self.top_p
+            self.model = Llama(
+                model_path=str(self.model_path),
+                n_ctx=self.context_length,
+                n_gpu_layers=0,  # Force CPU-only
+                n_threads=self.n_threads,
+                n_batch=self.n_batch,
+                use_mmap=True,
+                use_mlock=self.use_mlock,
+                logits_all=True,  # Required with a draft model, see load_model
+                draft_model=LlamaPromptLookupDecoding(num_pred_tokens=2),  # Fewer drafts pay off on CPU
+                verbose=False
             )
+            self.gpu_layers = 0
+            _LOADED_MODELS[id(self)] = self.model
+            self._enable_prompt_cache()
+            self._tokenize_template()
             logging.info(f"Successfully loaded model on CPU from {self.model_path}")
             return True
         except Exception as cpu_e:
             logging.error(f"Failed to load model on CPU: {str(cpu_e)}")
             return False
             
+    def _enable_prompt_cache(self):
+        """Keep KV states of past prompts so a shared prefix is not prefilled again
+        
+        llama.cpp already reuses the prefix still held in its live KV cache; the RAM
+        cache also covers prompts seen before the most recent one.
+        
+        Not used with a draft model: that forces logits for every position, so each
+        saved state carries an n_ctx x n_vocab scores copy that the cache's capacity
+        doesn't count, and memory grows without bound.
+        """
+        if self.prompt_cache_bytes <= 0:
+            return
+        if getattr(self.model, "draft_model", None) is not None:
+            logging.warning("Prompt cache disabled: it can't bound memory with speculative decoding")
+            return
+        self.model.set_cache(LlamaRAMCache(capacity_bytes=self.prompt_cache_bytes))
+
+    def _tokenize_template(self):
+        """Tokenize the fixed parts of the TinyLlama chat template once per model load"""
+        self._sys_ids = self.model.tokenize(self._sys_prefix.encode("utf-8"), add_bos=True, special=True)
+        self._asst_ids = self.model.tokenize(self._ASST_SUFFIX.encode("utf-8"), add_bos=False, special=True)
+        # The template and stop sequences assume "</s>" is the model's EOS token
+        if self.model.tokenize(b"</s>", add_bos=False, special=True) != [self.model.token_eos()]:
+            logging.warning(f"</s> is not the EOS token of {self.model_path}; stop sequences may not match")
+
     def generate_response(self, 
                          prompt: str,
                          max_tokens: int = 256,
                          temperature: Optional[float] = None,
-                         top_p: Optional[float] = None) -> str:
+                         top_p: Optional[float] = None) -> Iterator[str]:
         """
-        Generate a response for the given prompt
+        Generate a response for the given prompt, yielding text as it is decoded
         
         Args:
             prompt: Input text prompt
@@ -89,37 +241,81 @@ class InferenceHandler:
             temperature: Optional override for sampling temperature
             top_p: Optional override for top-p sampling
             
-        Returns:
-            Generated text response
+        Yields:
+            Generated text pieces in order
         """
-        if self.model is None:
-            if not self.load_model():
-                raise RuntimeError("Failed to load model")
-                
         # Use instance defaults if not specified
         temp = temperature if temperature is not None else self.temperature
         p = top_p if top_p is not None else self.top_p
         
-        try:
-            # Use the TinyLlama chat template
-            formatted_prompt = f"<|system|>You are a helpful AI assistant.</s><|user|>{prompt}</s><|assistant|>"
-            
-            response = self.model(
-                formatted_prompt,
-                max_new_tokens=max_tokens,
-                temperature=temp,
-                top_p=p,
-                stream=False
-            )
+        with self._lock:
+            if self.model is None:
+                if not self.load_model():
+                    raise RuntimeError("Failed to load model")
             
-            # Clean up response if needed
-            response = response.split("<|assistant|>")[-1].strip()
-            return response
+            try:
+                # Use the TinyLlama chat template, only the user prompt is tokenized per request
+                user_ids = self.model.tokenize(prompt.encode("utf-8"), add_bos=False, special=False)
+                input_ids = self._sys_ids + user_ids + self._asst_ids
+                
+                for chunk in self.model.create_completion(
+                    prompt=input_ids,
+                    max_tokens=max_tokens,
+                    temperature=temp,
+                    top_p=p,
+                    stop=STOP_SEQUENCES,
+                    echo=False,
+                    stream=True
+                ):
+                    yield chunk["choices"][0]["text"]
+                    
+            except Exception as e:
+                logging.error(f"Error generating response: {str(e)}")
+                raise
+
+    def generate_response_sync(self, 
+                              prompt: str,
+                              max_tokens: int = 256,
+                              temperature: Optional[float] = None,
+                              top_p: Optional[float] = None) -> str:
+        """
+        Generate a complete response for the given prompt
+        
+        Args:
+            prompt: Input text prompt
+            max_tokens: Maximum number of tokens to generate
+            temperature: Optional override for sampling temperature
+            top_p: Optional override for top-p sampling
             
-        except Exception as e:
-            logging.error(f"Error generating response: {str(e)}")
-            raise
+        Returns:
+            Generated text response
+        """
+        # Generation stops at the end of the assistant turn, so nothing needs cutting off
+        return "".join(self.generate_response(prompt, max_tokens, temperature, top_p)).strip()
+
+
+_SINGLETON: Optional[InferenceHandler] = None
+_SINGLETON_LOCK = threading.Lock()
 
-    def __del__(self):
-        """Cleanup when the handler is destroyed"""
-        self._cleanup()
\ No newline at end of file
+
+def get_handler(model_path: Optional[Path] = None, **kwargs) -> InferenceHandler:
+    """
+    Return the process-wide handler, creating it and loading its model on first use
+    
+    Args:
+        model_path: Path to the .gguf model file, required on the first call
+        **kwargs: InferenceHandler arguments used on the first call
+        
+    Returns:
+        The shared InferenceHandler with its model loaded
+    """
+    global _SINGLETON
+    with _SINGLETON_LOCK:
+        if _SINGLETON is None:
+            if model_path is None:
+                raise ValueError("model_path is required to create the handler")
+            handler = InferenceHandler(model_path, **kwargs)
+            if not handler.load_model():
+                raise RuntimeError(f"Failed to load model from {model_path}")
+            _SINGLETON = handler
+        return _SINGLETON
@@ -1,18 +1,75 @@
 # File: backend/utils/model_manager.py
 
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from tqdm import tqdm
 import hashlib
 import json
 import logging
+import re
 from typing import Optional, Dict, Any
-from functools import lru_cache
 import torch
+import transformers
+from huggingface_hub import get_hf_file_metadata, hf_hub_download, hf_hub_url
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from accelerate import init_empty_weights
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import sys
+import os
+import atexit
 import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to the standard library encoder
+    orjson = None
+
+try:
+    import blake3
+except ImportError:  # optional; model verification falls back to SHA-256
+    blake3 = None
+
+# Read size used when hashing model files
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+# Chunk size used when streaming model downloads
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Downloaded chunks buffered between the network and disk writer threads
+DOWNLOAD_QUEUE_SIZE = 8
+# Hugging Face Hub file URLs, downloaded through huggingface_hub
+# (set HF_HUB_ENABLE_HF_TRANSFER=1 with hf_transfer installed for parallel transfers)
+HF_RESOLVE_URL = re.compile(
+    r"https://huggingface\.co/(?P<repo_id>[^/]+/[^/]+)/resolve/(?P<revision>[^/]+)/(?P<filename>.+)"
+)
+# Values accepted for model_config["quantization"] in ModelManager.load_model
+QUANTIZATION_MODES = ("none", "int8", "int4", "hqq4")
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """Encode obj as UTF-8 JSON, indented with sorted keys or compact"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS if indent else 0
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, indent=2, sort_keys=True).encode()
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def json_loads(data: bytes) -> Any:
+    """Decode UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def write_atomic(path: Path, data: bytes):
+    """Write data to a temporary file and swap it into place"""
+    temp_file = path.with_suffix(path.suffix + ".tmp")
+    temp_file.write_bytes(data)
+    os.replace(temp_file, path)
 
 class ModelCache:
     def __init__(self, cache_dir: Path, max_size_gb: float = 4.0, ttl_hours: int = 24):
@@ -21,23 +78,45 @@ class ModelCache:
         self.max_size_bytes = int(max_size_gb * 1024 * 1024 * 1024)
         self.ttl = timedelta(hours=ttl_hours)
         self.cache_index_file = self.cache_dir / "cache_index.json"
+        # Index writes are batched; changes are flushed after put and at exit
+        self._dirty = False
+        # Hash of the index as last read or written, to skip no-op writes
+        self._index_hash = None
+        atexit.register(self._flush)
         self.load_cache_index()
 
     def load_cache_index(self):
         if self.cache_index_file.exists():
-            with open(self.cache_index_file) as f:
-                self.cache_index = json.load(f)
+            data = self.cache_index_file.read_bytes()
+            self._index_hash = hash(data)
+            self.cache_index = json_loads(data)
+            # Keep entries oldest first so eviction pops from the front.
+            # ISO timestamps sort chronologically as plain strings.
+            self.cache_index["entries"] = OrderedDict(sorted(
+                self.cache_index["entries"].items(),
+                key=lambda item: item[1]["timestamp"]
+            ))
         else:
             self.cache_index = {
-                "entries": {},
+                "entries": OrderedDict(),
                 "total_size": 0,
                 "last_cleanup": datetime.now().isoformat()
             }
             self.save_cache_index()
 
     def save_cache_index(self):
-        with open(self.cache_index_file, 'w') as f:
-            json.dump(self.cache_index, f, indent=2)
+        """Mark the index as changed; it is written on the next flush"""
+        self._dirty = True
+
+    def _flush(self):
+        """Atomically write the index if it changed since the last write"""
+        if not self._dirty:
+            return
+        data = json_dumps(self.cache_index)
+        if hash(data) != self._index_hash:
+            write_atomic(self.cache_index_file, data)
+            self._index_hash = hash(data)
+        self._dirty = False
 
     def get_cache_key(self, model_name: str, config: Dict[str, Any]) -> str:
         """Generate a unique cache key based on model and config"""
@@ -50,7 +129,7 @@ class ModelCache:
             return None
 
         entry = self.cache_index["entries"][cache_key]
-        cache_file = self.cache_dir / f"{cache_key}.pt"
+        cache_file, config_file = self._cache_files(cache_key)
 
         # Check if cache entry is expired
         cached_time = datetime.fromisoformat(entry["timestamp"])
@@ -58,12 +137,24 @@ class ModelCache:
             self.invalidate(cache_key)
             return None
 
-        if not cache_file.exists():
+        # Entries from older cache formats are dropped
+        if (entry.get("format") != "state_dict" or
+                not cache_file.exists() or not config_file.exists()):
             self.invalidate(cache_key)
             return None
 
         try:
-            return torch.load(cache_file)
+            with open(config_file) as f:
+                cached = json.load(f)
+            # safetensors maps the file instead of unpickling every tensor
+            state_dict = load_file(str(cache_file), device="cpu")
+            # Shared tensors are stored once; metadata maps the dropped names
+            with safe_open(str(cache_file), framework="pt") as f:
+                for name, kept in (f.metadata() or {}).items():
+                    if kept in state_dict:
+                        state_dict.setdefault(name, state_dict[kept])
+            cached["state_dict"] = state_dict
+            return cached
         except Exception as e:
             logging.error(f"Error loading cache entry: {e}")
             self.invalidate(cache_key)
@@ -74,41 +165,67 @@ class ModelCache:
         # Cleanup if needed
         self._ensure_cache_size(size_bytes)
 
-        # Save cache entry
-        cache_file = self.cache_dir / f"{cache_key}.pt"
-        torch.save(data, cache_file)
+        # Save tensors as safetensors and everything else as a JSON sidecar
+        cache_file, config_file = self._cache_files(cache_key)
+        tensors, aliases = self._dedupe_tensors(data["state_dict"])
+        save_file(tensors, str(cache_file), metadata=aliases)
+        with open(config_file, 'w') as f:
+            json.dump({k: v for k, v in data.items() if k != "state_dict"}, f)
 
         self.cache_index["entries"][cache_key] = {
             "timestamp": datetime.now().isoformat(),
-            "size": size_bytes
+            "size": size_bytes,
+            "format": "state_dict"
         }
+        self.cache_index["entries"].move_to_end(cache_key)
         self.cache_index["total_size"] += size_bytes
         self.save_cache_index()
+        self._flush()
 
     def invalidate(self, cache_key: str):
         """Remove item from cache"""
         if cache_key in self.cache_index["entries"]:
             entry = self.cache_index["entries"][cache_key]
-            cache_file = self.cache_dir / f"{cache_key}.pt"
+            legacy_file = self.cache_dir / f"{cache_key}.pt"
             
-            if cache_file.exists():
-                cache_file.unlink()
+            for cache_file in (*self._cache_files(cache_key), legacy_file):
+                if cache_file.exists():
+                    cache_file.unlink()
                 
             self.cache_index["total_size"] -= entry["size"]
             del self.cache_index["entries"][cache_key]
             self.save_cache_index()
 
+    @staticmethod
+    def _dedupe_tensors(state_dict: Dict[str, torch.Tensor]):
+        """Keep one copy of tensors that share memory, such as tied weights
+
+        Returns:
+            The tensors to save and a mapping of each dropped name to the kept one
+        """
+        tensors, aliases, seen = {}, {}, {}
+        for name, tensor in state_dict.items():
+            ident = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))
+            if ident in seen:
+                aliases[name] = seen[ident]
+            else:
+                seen[ident] = name
+                tensors[name] = tensor.contiguous()
+        return tensors, aliases
+
+    def _cache_files(self, cache_key: str):
+        """Paths of the weights file and config sidecar for a cache entry"""
+        return (
+            self.cache_dir / f"{cache_key}.safetensors",
+            self.cache_dir / f"{cache_key}.json"
+        )
+
     def _ensure_cache_size(self, needed_bytes: int):
         """Ensure cache has enough space by removing old entries"""
         while (self.cache_index["total_size"] + needed_bytes > self.max_size_bytes and 
                self.cache_index["entries"]):
-            # Remove oldest entry
-            oldest_key = min(
-                self.cache_index["entries"].keys(),
-                key=lambda k: datetime.fromisoformat(
-                    self.cache_index["entries"][k]["timestamp"]
-                )
-            )
+            # Remove oldest entry, which is always first
+            oldest_key = next(iter(self.cache_index["entries"]))
             self.invalidate(oldest_key)
 
 class ModelManager:
@@ -122,17 +239,31 @@ class ModelManager:
             Path(cache_dir), 
             max_size_gb=max_cache_size_gb
         )
+        # Models may be verified and downloaded from several threads at once.
+        # Held across every change to self.config and its save, so a save never
+        # serializes a dict another thread is changing. Reentrant so helpers
+        # that save can be called with it held.
+        self._config_lock = threading.RLock()
+        # Hash of models.json as last read or written, to skip no-op writes
+        self._config_hash = None
+        # Loaded tokenizers, keyed by model name
+        self._tokenizers: Dict[str, Any] = {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.load_config()
+        self._migrate_model_files()
         
     def load_config(self):
         if self.config_file.exists():
-            with open(self.config_file) as f:
-                self.config = json.load(f)
-                # Update any "expected_hash_here" to None
-                for _, model_info in self.config["models"].items():
-                    if model_info["sha256"] == "expected_hash_here":
-                        model_info["sha256"] = None
-                self.save_config()
+            self.config = json_loads(self.config_file.read_bytes())
+            self._config_hash = hash(json_dumps(self.config, indent=True))
+            # Update any "expected_hash_here" to None
+            for _, model_info in self.config["models"].items():
+                if model_info["sha256"] == "expected_hash_here":
+                    model_info["sha256"] = None
+            self.save_config()
         else:
             self.config = {
                 "models": {
@@ -152,29 +283,55 @@ class ModelManager:
             self.save_config()
 
     def save_config(self):
-        with open(self.config_file, 'w') as f:
-            json.dump(self.config, f, indent=2)
+        """Atomically write models.json if the config changed"""
+        with self._config_lock:
+            data = json_dumps(self.config, indent=True)
+            if hash(data) == self._config_hash:
+                return
+            write_atomic(self.config_file, data)
+            self._config_hash = hash(data)
     
     def calculate_hash(self, file_path: Path) -> str:
         """Calculate SHA256 hash of a file"""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
+        with open(file_path, "rb", buffering=0) as f:
+            # Python 3.11+ hashes in C without the GIL
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "sha256").hexdigest()
+
+            sha256_hash = hashlib.sha256()
+            self._update_hash(sha256_hash, f)
         return sha256_hash.hexdigest()
 
+    def calculate_blake3(self, file_path: Path) -> str:
+        """Calculate BLAKE3 hash of a file using all cores"""
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        # Hashes straight from a memory map instead of reading in chunks
+        hasher.update_mmap(str(file_path))
+        return hasher.hexdigest()
+
+    def _update_hash(self, hash_obj, f):
+        """Feed an open binary file into hash_obj through one reusable buffer"""
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            hash_obj.update(view[:size])
+
     def download_model(self, model_name: str, force: bool = False) -> bool:
         """Download a model with progress bar and validation"""
         if model_name not in self.config["models"]:
             raise ValueError(f"Unknown model: {model_name}")
             
         model_info = self.config["models"][model_name]
-        model_path = self.models_dir / model_name
+        model_path = self._model_file(model_name)
         
         # Convert "expected_hash_here" to None if it exists
-        if model_info["sha256"] == "expected_hash_here":
-            model_info["sha256"] = None
-            self.save_config()
+        with self._config_lock:
+            if model_info["sha256"] == "expected_hash_here":
+                model_info["sha256"] = None
+                self.save_config()
         
         # Check if model exists and is valid
         if not force and model_path.exists():
@@ -183,105 +340,389 @@ class ModelManager:
                 return True
             logging.warning(f"Model {model_name} exists but failed verification")
                 
+        hub_file = HF_RESOLVE_URL.fullmatch(model_info["url"])
+        if hub_file:
+            return self._download_from_hub(model_name, hub_file, force)
+
         # Download model
+        temp_path = model_path.with_suffix('.tmp')
         try:
+            headers = {}
+            etag = model_info.get("etag")
+            # Resume a partial download left behind by an earlier attempt. Its
+            # validator was saved when that transfer started; without one the
+            # server can't tell whether the file changed, so start over.
+            validator = model_info.get("partial_validator")
+            resume_from = temp_path.stat().st_size if temp_path.exists() and validator else 0
+            if resume_from:
+                headers["Range"] = f"bytes={resume_from}-"
+                # Server sends the whole file instead if it changed since
+                headers["If-Range"] = validator
+            elif force and etag and model_path.exists() and self.verify_model(model_name):
+                # Only fetch again if the file changed on the server
+                headers["If-None-Match"] = etag
+
             logging.info(f"Downloading {model_name}...")
-            response = requests.get(model_info["url"], stream=True)
+            response = self.session.get(model_info["url"], stream=True, headers=headers)
+            if response.status_code == 304:
+                logging.info(f"Model {model_name} is unchanged on the server")
+                return True
+            if response.status_code == 416:
+                # Partial file doesn't fit the remote file anymore, start over
+                response.close()
+                temp_path.unlink()
+                response = self.session.get(model_info["url"], stream=True)
             response.raise_for_status()
-            total_size = int(response.headers.get('content-length', model_info["size"]))
+            if response.status_code != 206:
+                resume_from = 0
+                # Saved before any bytes land so a later attempt can resume safely
+                with self._config_lock:
+                    model_info["partial_validator"] = self._range_validator(response)
+                    self.save_config()
+            total_size = resume_from + int(response.headers.get('content-length', model_info["size"] - resume_from))
             
-            # Use temporary file for download
-            temp_path = model_path.with_suffix('.tmp')
-            with open(temp_path, 'wb') as f, tqdm(
+            # Use temporary file for download, hashing bytes as they arrive
+            # so the file doesn't have to be read back afterwards. A writer
+            # thread hashes and writes while this thread keeps receiving.
+            sha256_hash = hashlib.sha256()
+            if resume_from:
+                logging.info(f"Resuming {model_name} from byte {resume_from}")
+                with open(temp_path, "rb", buffering=0) as f:
+                    self._update_hash(sha256_hash, f)
+            chunks = queue.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+            with open(temp_path, 'ab' if resume_from else 'wb') as f, tqdm(
                 desc=model_name,
                 total=total_size,
+                initial=resume_from,
                 unit='iB',
                 unit_scale=True,
                 unit_divisor=1024,
-            ) as pbar:
-                for data in response.iter_content(chunk_size=1024*1024):
-                    size = f.write(data)
-                    pbar.update(size)
+            ) as pbar, ThreadPoolExecutor(max_workers=1) as writer_pool:
+                writer = writer_pool.submit(self._write_chunks, chunks, f, sha256_hash, pbar)
+                try:
+                    for data in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        chunks.put(data)
+                finally:
+                    chunks.put(None)
+                writer.result()
             
-            # Calculate hash of downloaded file
-            calculated_hash = self.calculate_hash(temp_path)
+            calculated_hash = sha256_hash.hexdigest()
             logging.info(f"Calculated hash for {model_name}: {calculated_hash}")
             
-            # Update hash in config
-            self.config["models"][model_name]["sha256"] = calculated_hash
-            self.save_config()
+            # Update hash and ETag in config; a BLAKE3 hash of the old file is stale
+            with self._config_lock:
+                self.config["models"][model_name]["sha256"] = calculated_hash
+                self.config["models"][model_name]["etag"] = response.headers.get("ETag")
+                self.config["models"][model_name].pop("blake3", None)
+                self.config["models"][model_name].pop("partial_validator", None)
+                self.save_config()
             logging.info(f"Updated hash in config for {model_name}")
             
             # Move to final location
             temp_path.rename(model_path)
+            with self._config_lock:
+                self._set_fingerprint(model_name, "sha256", calculated_hash)
+                self.save_config()
             logging.info(f"Successfully downloaded {model_name}")
             return True
             
+        except Exception as e:
+            # Keep any partial file so the next attempt can resume it
+            logging.error(f"Error downloading {model_name}: {str(e)}")
+            return False
+
+    def _download_from_hub(self, model_name: str, hub_file: re.Match, force: bool) -> bool:
+        """Download a Hugging Face Hub file in place, then verify and record its SHA-256"""
+        model_path = self._model_file(model_name)
+        try:
+            logging.info(f"Downloading {model_name} from the Hugging Face Hub...")
+            # The file stays where the Hub put it so its local_dir metadata stays valid.
+            # An existing file got here by failing verification, so fetch it again.
+            hf_hub_download(
+                repo_id=hub_file["repo_id"],
+                filename=hub_file["filename"],
+                revision=hub_file["revision"],
+                local_dir=self.models_dir,
+                force_download=force or model_path.exists()
+            )
+
+            calculated_hash = self.calculate_hash(model_path)
+            logging.info(f"Calculated hash for {model_name}: {calculated_hash}")
+
+            # The ETag of an LFS file is its SHA-256, check the download against it
+            metadata = get_hf_file_metadata(hf_hub_url(
+                hub_file["repo_id"], hub_file["filename"], revision=hub_file["revision"]
+            ))
+            etag = (metadata.etag or "").strip('"')
+            if re.fullmatch(r"[0-9a-f]{64}", etag) and etag != calculated_hash:
+                logging.error(f"Downloaded {model_name} does not match the Hub's SHA-256 {etag}")
+                # Don't leave it for verify_model to adopt as a first-seen hash
+                model_path.unlink()
+                return False
+
+            # Update hash in config; a BLAKE3 hash of the old file is stale
+            with self._config_lock:
+                self.config["models"][model_name]["sha256"] = calculated_hash
+                self.config["models"][model_name].pop("blake3", None)
+                self._set_fingerprint(model_name, "sha256", calculated_hash)
+                self.save_config()
+            logging.info(f"Successfully downloaded {model_name}")
+            return True
+
         except Exception as e:
             logging.error(f"Error downloading {model_name}: {str(e)}")
-            if temp_path.exists():
-                temp_path.unlink()
             return False
 
-    @lru_cache(maxsize=1)  # Cache the last used tokenizer
+    def _model_file(self, model_name: str) -> Path:
+        """Path of a model file; Hub files keep their Hub filename inside models_dir"""
+        if model_name not in self.config["models"]:
+            raise ValueError(f"Unknown model: {model_name}")
+        hub_file = HF_RESOLVE_URL.fullmatch(self.config["models"][model_name]["url"])
+        return self.models_dir / (hub_file["filename"] if hub_file else model_name)
+
+    def _migrate_model_files(self):
+        """Rename Hub files that older versions stored under the model name"""
+        for model_name in self.config["models"]:
+            legacy_path = self.models_dir / model_name
+            model_path = self._model_file(model_name)
+            if model_path != legacy_path and legacy_path.is_file() and not model_path.exists():
+                model_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(legacy_path, model_path)  # Keeps mtime, so the fingerprint holds
+
+    def _range_validator(self, response: requests.Response) -> Optional[str]:
+        """Strong ETag or Last-Modified of a response, usable in If-Range"""
+        etag = response.headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return response.headers.get("Last-Modified")
+
+    def _write_chunks(self, chunks: queue.Queue, f, sha256_hash, pbar):
+        """Hash and write downloaded chunks until a None sentinel arrives"""
+        error = None
+        while True:
+            data = chunks.get()
+            if data is None:
+                break
+            # Keep draining after a failure so the downloading thread never blocks
+            if error is None:
+                try:
+                    sha256_hash.update(data)
+                    pbar.update(f.write(data))
+                except Exception as e:
+                    error = e
+        if error is not None:
+            raise error
+
     def load_tokenizer(self, model_name: str):
         """Load tokenizer with caching"""
-        model_path = self.models_dir / model_name
-        return AutoTokenizer.from_pretrained(str(model_path))
+        tokenizer = self._tokenizers.get(model_name)
+        if tokenizer is None:
+            model_path = self.models_dir / model_name
+            # Prefer the Rust-backed fast tokenizer
+            tokenizer = AutoTokenizer.from_pretrained(str(model_path), use_fast=True)
+            self._tokenizers[model_name] = tokenizer
+        return tokenizer
+
+    def _default_load_kwargs(self) -> Dict[str, Any]:
+        """Pick device and dtype so weights are materialized on-device instead of as FP32 on the CPU"""
+        if torch.backends.mps.is_available():
+            device, dtype = torch.device("mps"), torch.float16  # MPS lacks bf16 on older macOS
+        elif torch.cuda.is_available():
+            device = torch.device("cuda")
+            dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        else:
+            device, dtype = torch.device("cpu"), torch.bfloat16
+        return {
+            "torch_dtype": dtype,
+            "low_cpu_mem_usage": True,
+            "device_map": {"": device}
+        }
 
     def load_model(self, model_name: str, model_config: Optional[Dict[str, Any]] = None) -> Any:
-        """Load model with caching support"""
+        """Load model with caching support
+
+        model_config is passed on to from_pretrained, except for an optional
+        "quantization" entry, one of QUANTIZATION_MODES.
+        """
         if model_config is None:
             model_config = {}
+        quantization = model_config.get("quantization", "none")
+        if quantization == "none":
+            model_config = {k: v for k, v in model_config.items() if k != "quantization"}
 
-        # Generate cache key based on model name and config
+        # Generate cache key based on model name and config, quantization included
         cache_key = self.cache.get_cache_key(model_name, model_config)
         
-        # Try to get from cache
-        cached_model = self.cache.get(cache_key)
-        if cached_model is not None:
-            logging.info(f"Loaded model {model_name} from cache")
-            return cached_model
+        load_kwargs = {
+            **self._default_load_kwargs(),
+            **self._quantization_kwargs(quantization),
+            **{k: v for k, v in model_config.items() if k != "quantization"}
+        }
+
+        # Quantized layers can't be rebuilt from a plain state_dict, so only
+        # full-precision models go through the cache
+        cached = self.cache.get(cache_key) if quantization == "none" else None
+        if cached is not None:
+            try:
+                cached_model = self.load_model_from_cache(cached)
+                # Cached weights come back on the CPU
+                device_map = load_kwargs.get("device_map")
+                if isinstance(device_map, dict) and "" in device_map:
+                    cached_model = cached_model.to(device_map[""])
+                logging.info(f"Loaded model {model_name} from cache")
+                return cached_model
+            except Exception as e:
+                # e.g. keys renamed by a transformers upgrade; rebuild the entry
+                logging.error(f"Error rebuilding cached model {model_name}: {str(e)}")
+                self.cache.invalidate(cache_key)
 
-        # Load model normally
+        # Load model normally, straight onto the target device in half precision
         model_path = self.models_dir / model_name
         model = AutoModelForCausalLM.from_pretrained(
             str(model_path),
-            **model_config
+            **load_kwargs
         )
 
+        if quantization != "none":
+            return model
+
         # Cache the loaded model
-        model_size = sum(p.numel() * p.element_size() for p in model.parameters())
-        self.cache.put(cache_key, model, model_size)
+        state_dict = model.state_dict()
+        # Count tied weights once, as they are stored in the cache
+        unique_tensors = {t.data_ptr(): t for t in state_dict.values()}
+        model_size = sum(t.numel() * t.element_size() for t in unique_tensors.values())
+        self.cache.put(cache_key, {
+            "state_dict": state_dict,
+            "config": model.config.to_dict(),
+            "cls": model.__class__.__name__
+        }, model_size)
         
         return model
 
-    def verify_model(self, model_name: str) -> bool:
-        """Verify model file against expected hash"""
-        model_path = self.models_dir / model_name
+    def _quantization_kwargs(self, quantization: str) -> Dict[str, Any]:
+        """from_pretrained arguments for a quantization mode"""
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        if quantization == "int8":
+            quantization_config = transformers.BitsAndBytesConfig(load_in_8bit=True)
+        elif quantization == "int4":
+            quantization_config = transformers.BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16
+            )
+        elif quantization == "hqq4":
+            quantization_config = transformers.HqqConfig(nbits=4, group_size=64)
+        else:
+            return {}
+        return {
+            "quantization_config": quantization_config,
+            "torch_dtype": torch.bfloat16,
+            "device_map": "auto"
+        }
+
+    def load_model_from_cache(self, cached: Dict[str, Any]) -> Any:
+        """Rebuild a transformers model from a cached state_dict and config"""
+        model_cls = getattr(transformers, cached["cls"])
+        config = model_cls.config_class.from_dict(cached["config"])
+        # Skip random weight init; parameters are replaced by the cached tensors
+        with init_empty_weights():
+            model = model_cls(config)
+        # Strict, so a missing key fails here instead of leaving a meta tensor behind
+        model.load_state_dict(cached["state_dict"], strict=True, assign=True)
+        model.tie_weights()
+        return model
+
+    def verify_model(self, model_name: str, force: bool = False) -> bool:
+        """Verify model file against expected hash
+        
+        The hash is only recomputed when the file's size or mtime changed since
+        it was last hashed, unless force is set. A recorded BLAKE3 hash is
+        preferred; SHA-256 is only checked when that is all the config has.
+        """
+        if model_name not in self.config["models"]:
+            return False
+        model_path = self._model_file(model_name)
         if not model_path.exists():
             return False
             
-        # If no hash is set, calculate and save it
-        if self.config["models"][model_name]["sha256"] is None:
-            calculated_hash = self.calculate_hash(model_path)
-            self.config["models"][model_name]["sha256"] = calculated_hash
-            self.save_config()
-            logging.info(f"Saved new hash for existing {model_name}: {calculated_hash}")
+        model_info = self.config["models"][model_name]
+        algorithm, expected_hash = self._expected_hash(model_info)
+        stat = model_path.stat()
+        fingerprint = model_info.get("fingerprint")
+        if (not force and expected_hash is not None and fingerprint and
+                fingerprint["size"] == stat.st_size and
+                fingerprint["mtime_ns"] == stat.st_mtime_ns):
+            return fingerprint.get(algorithm) == expected_hash
+
+        # Nothing published to check against, so record the faster hash
+        if expected_hash is None and blake3 is not None:
+            algorithm = "blake3"
+        calculated_hash = self._hash_file(algorithm, model_path)
+        
+        # If no hash is set, save the calculated one
+        if expected_hash is None:
+            with self._config_lock:
+                self._set_fingerprint(model_name, algorithm, calculated_hash)
+                model_info[algorithm] = calculated_hash
+                self.save_config()
+            logging.info(f"Saved new {algorithm} hash for existing {model_name}: {calculated_hash}")
             return True
-            
-        calculated_hash = self.calculate_hash(model_path)
-        expected_hash = self.config["models"][model_name]["sha256"]
-        return calculated_hash == expected_hash
+
+        valid = calculated_hash == expected_hash
+        # Matched the published checksum; later checks can use BLAKE3
+        blake3_hash = None
+        if valid and algorithm == "sha256" and blake3 is not None:
+            blake3_hash = self.calculate_blake3(model_path)
+        with self._config_lock:
+            self._set_fingerprint(model_name, algorithm, calculated_hash)
+            if blake3_hash is not None:
+                model_info["blake3"] = blake3_hash
+                model_info["fingerprint"]["blake3"] = blake3_hash
+            self.save_config()
+        return valid
+
+    def _expected_hash(self, model_info: Dict[str, Any]):
+        """Pick the recorded hash to verify against and its algorithm"""
+        if blake3 is not None and model_info.get("blake3"):
+            return "blake3", model_info["blake3"]
+        return "sha256", model_info["sha256"]
+
+    def _hash_file(self, algorithm: str, file_path: Path) -> str:
+        """Hash a file with the given algorithm"""
+        if algorithm == "blake3":
+            return self.calculate_blake3(file_path)
+        return self.calculate_hash(file_path)
+
+    def _set_fingerprint(self, model_name: str, algorithm: str, file_hash: str):
+        """Remember the hash of the model file as it is now on disk
+
+        Call with _config_lock held.
+        """
+        stat = self._model_file(model_name).stat()
+        self.config["models"][model_name]["fingerprint"] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            algorithm: file_hash
+        }
     
     def ensure_models(self) -> bool:
         """Ensure all required models are downloaded"""
-        success = True
-        for model_name, info in self.config["models"].items():
-            if info.get("required", False):
-                if not self.verify_model(model_name):
-                    success = success and self.download_model(model_name)
-        return success
+        required = [
+            model_name for model_name, info in self.config["models"].items()
+            if info.get("required", False)
+        ]
+        if not required:
+            return True
+
+        # Verify and download models in parallel
+        with ThreadPoolExecutor(max_workers=min(4, len(required))) as pool:
+            results = list(pool.map(self._ensure_model, required))
+        return all(results)
+
+    def _ensure_model(self, model_name: str) -> bool:
+        """Verify a model, downloading it if needed"""
+        return self.verify_model(model_name) or self.download_model(model_name)
     
     def get_model_info(self, model_name: str) -> Dict[str, Any]:
         """Get information about a model"""
@@ -290,7 +731,7 @@ class ModelManager:
         
         model_info = self.config["models"][model_name].copy()
         model_info["downloaded"] = self.verify_model(model_name)
-        model_path = self.models_dir / model_name
+        model_path = self._model_file(model_name)
         if model_path.exists():
             model_info["actual_size"] = model_path.stat().st_size
         return model_info
@@ -303,7 +744,7 @@ class ModelManager:
         if not self.verify_model(model_name):
             self.download_model(model_name)
             
-        return self.models_dir / model_name
+        return self._model_file(model_name)
     
 def main():
     logging.basicConfig(
@@ -317,6 +758,8 @@ def main():
     parser.add_argument('--model', help='Model name for specific operations')
     parser.add_argument('--force', action='store_true', 
                        help='Force download even if model exists')
+    parser.add_argument('--force-verify', action='store_true',
+                       help='Rehash model files even if unchanged since last verified')
     parser.add_argument('--models-dir', default='backend/models',
                        help='Directory for storing models')
     parser.add_argument('--cache-dir', default='backend/cache',
@@ -363,13 +806,13 @@ def main():
         elif args.command == 'verify':
             if args.model:
                 # Verify specific model
-                valid = manager.verify_model(args.model)
+                valid = manager.verify_model(args.model, force=args.force_verify)
                 print(f"Model {args.model} is {'valid' if valid else 'invalid'}")
             else:
                 # Verify all models
                 all_valid = True
                 for model_name in manager.config['models']:
-                    valid = manager.verify_model(model_name)
+                    valid = manager.verify_model(model_name, force=args.force_verify)
                     print(f"Model {model_name} is {'valid' if valid else 'invalid'}")
                     all_valid = all_valid and valid
                 if not all_valid: